@@ -1,23 +1,26 @@
 import os
+import csv
 from pathlib import Path
 import hmac
+import hashlib
+import shutil
+import sqlite3
 import tempfile
-import pandas as pd
+import threading
+import time
+import numpy as np
 import uuid
 
 import streamlit as st
-
-from cassandra.cluster import Cluster
-from cassandra.auth import PlainTextAuthProvider
+from streamlit_cookies_manager import CookieManager
 
 from langchain.chat_models import ChatOpenAI
 from langchain.vectorstores import AstraDB
 from langchain.embeddings import OpenAIEmbeddings
+from langchain.schema.embeddings import Embeddings
 from langchain.memory import ConversationBufferWindowMemory
 from langchain.memory import AstraDBChatMessageHistory
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.document_loaders import PyPDFLoader
-from langchain.schema import HumanMessage, AIMessage
+from langchain.schema import HumanMessage, AIMessage, Document
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema.runnable import RunnableMap
 
@@ -25,19 +28,127 @@ from langchain.callbacks.base import BaseCallbackHandler
 
 print("Started")
 
-# Get a unique session id for memory
+# Get a session id for memory, kept in a browser cookie so reloads resume the same chat history
+cookies = CookieManager()
+if not cookies.ready():
+    st.stop()  # Wait for the cookies to be read from the browser.
 if "session_id" not in st.session_state:
-    st.session_state.session_id = uuid.uuid4()
+    st.session_state.session_id = cookies.get("session_id") or uuid.uuid4().hex
+if cookies.get("session_id") != st.session_state.session_id:
+    cookies["session_id"] = st.session_state.session_id
+    cookies.save()
 
 # Streaming call back handler for responses
 class StreamHandler(BaseCallbackHandler):
     def __init__(self, container, initial_text=""):
         self.container = container
-        self.text = initial_text
+        self._parts = [initial_text]
+        self._last_flush = time.perf_counter()
+        self._pending = 0
 
     def on_llm_new_token(self, token: str, **kwargs):
-        self.text += token
-        self.container.markdown(self.text + "▌")
+        self._parts.append(token)
+        self._pending += 1
+        # Redraw at most every 50ms or 8 tokens, whichever comes first
+        if time.perf_counter() - self._last_flush >= 0.05 or self._pending >= 8:
+            self.flush()
+
+    def on_llm_end(self, response, **kwargs):
+        self.flush()
+
+    def flush(self):
+        # Only join the collected tokens when drawing
+        text = "".join(self._parts)
+        self.container.markdown(text + "▌")
+        self._last_flush = time.perf_counter()
+        self._pending = 0
+
+# Embeddings wrapper that persists vectors in SQLite so identical texts are only embedded once
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embedding, path):
+        self.embedding = embedding
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS emb (hash BLOB PRIMARY KEY, vec BLOB)")
+
+    def _hash(self, text):
+        return hashlib.blake2b(f"{self.embedding.model}{text}".encode(), digest_size=16).digest()
+
+    def embed_documents(self, texts):
+        hashes = [self._hash(text) for text in texts]
+        with self.lock:
+            cached = {}
+            # Stay below SQLite's limit on the number of query parameters
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i:i + 500]
+                rows = self.connection.execute(f"SELECT hash, vec FROM emb WHERE hash IN ({','.join('?' * len(batch))})", batch).fetchall()
+                cached.update({hash: np.frombuffer(vec, dtype=np.float32).tolist() for hash, vec in rows})
+
+        # Only send the misses to OpenAI
+        misses = list({hash: text for hash, text in zip(hashes, texts) if hash not in cached}.items())
+        if misses:
+            vectors = self.embedding.embed_documents([text for _, text in misses])
+            with self.lock:
+                self.connection.executemany("INSERT OR IGNORE INTO emb VALUES (?, ?)", [(hash, np.asarray(vec, dtype=np.float32).tobytes()) for (hash, _), vec in zip(misses, vectors)])
+                self.connection.commit()
+            cached.update({hash: vec for (hash, _), vec in zip(misses, vectors)})
+        return [cached[hash] for hash in hashes]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+# Semantic cache for answers on (nearly) identical questions, persisted per user in SQLite
+class SemanticCache:
+    def __init__(self, path, username, threshold, max_entries):
+        self.username = username
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS answers (username TEXT, question TEXT, answer TEXT, sources TEXT, vec BLOB)")
+        # Load the newest entries, oldest first
+        rows = self.connection.execute("SELECT question, answer, sources, vec FROM answers WHERE username = ? ORDER BY rowid DESC LIMIT ?", (username, max_entries)).fetchall()[::-1]
+        # Keep the normalized question vectors as one (N, d) matrix next to the cached answers
+        self.entries = [(question, answer, sources) for question, answer, sources, _ in rows]
+        self.vectors = np.stack([np.frombuffer(vec, dtype=np.float32) for *_, vec in rows]) if rows else None
+
+    @staticmethod
+    def normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def lookup(self, vector):
+        """Returns the cached (question, answer, sources) closest to `vector` if it exceeds the threshold, else `None`."""
+        with self.lock:
+            if self.vectors is None:
+                return None
+            scores = self.vectors @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            return self.entries[best]
+
+    def add(self, question, answer, sources, vector):
+        with self.lock:
+            self.entries.append((question, answer, sources))
+            self.vectors = vector[None, :] if self.vectors is None else np.vstack([self.vectors, vector])
+            self.connection.execute("INSERT INTO answers VALUES (?, ?, ?, ?, ?)", (self.username, question, answer, sources, vector.tobytes()))
+
+            # Evict the oldest entries above the maximum
+            if len(self.entries) > self.max_entries:
+                self.entries = self.entries[-self.max_entries:]
+                self.vectors = self.vectors[-self.max_entries:]
+                self.connection.execute("DELETE FROM answers WHERE username = ? AND rowid NOT IN (SELECT rowid FROM answers WHERE username = ? ORDER BY rowid DESC LIMIT ?)", (self.username, self.username, self.max_entries))
+            self.connection.commit()
+
+    def clear(self):
+        """Drops all cached answers of the user, e.g. when the context they were based on changes."""
+        with self.lock:
+            self.entries = []
+            self.vectors = None
+            self.connection.execute("DELETE FROM answers WHERE username = ?", (self.username,))
+            self.connection.commit()
 
 #################
 ### Constants ###
@@ -47,12 +158,26 @@ class StreamHandler(BaseCallbackHandler):
 top_k_vectorstore = 4
 top_k_memory = 3
 
+# Define how many browser sessions keep their chat history and memory cached, and for how long (in seconds)
+session_cache_max_entries = 100
+session_cache_ttl = 24 * 60 * 60
+
+# Define the number of chunks embedded (in one OpenAI request) and inserted per step when uploading
+upload_batch_size = 512
+
+# Define the minimal cosine similarity for reusing a cached answer
+# OpenAI embeddings score unrelated questions fairly high as well, so keep this strict
+semantic_cache_threshold = st.secrets.get("semantic_cache_threshold", 0.95)
+
+# Define the maximum number of cached answers per user
+semantic_cache_max_entries = 1000
+
 ###############
 ### Globals ###
 ###############
 
 global lang_dict
-global rails_dict
+global rails_text
 global session
 global embedding
 global vectorstore
@@ -60,6 +185,7 @@ global retriever
 global model
 global chat_history
 global memory
+global semantic_cache
 
 #################
 ### Functions ###
@@ -99,72 +225,126 @@ def logout():
     del st.session_state.password_correct
     del st.session_state.user
     del st.session_state.messages
-    st.cache_resource.clear()
-    st.cache_data.clear()
+    # Start a new chat history, so the next login in this browser doesn't resume this one
+    st.session_state.session_id = uuid.uuid4().hex
+    # Resources are cached per username, so there is no need to clear them for all users
 
 # Function for Vectorizing uploaded data into Astra DB
 def vectorize_text(uploaded_files):
-    for uploaded_file in uploaded_files:
-        if uploaded_file is not None:
-            
-            # Write to temporary file
-            temp_dir = tempfile.TemporaryDirectory()
-            file = uploaded_file
-            print(f"""Processing: {file}""")
-            temp_filepath = os.path.join(temp_dir.name, file.name)
+    # Only needed for uploads, so imported here instead of on every script run
+    from langchain.document_loaders import PyMuPDFLoader
+
+    # Create the text splitter, measuring chunks in tokens of the embedding's cl100k_base encoding
+    # Chunk overlap defaults to 0 as recursive splitting without overlap retrieved more precisely
+    # than any fixed-overlap configuration in chunking ablations, while storing no duplicate text
+    # 400 tokens corresponds to the former chunk size of about 1500 characters
+    chunk_size = st.secrets.get("chunk_size", 400)
+    chunk_overlap = st.secrets.get("chunk_overlap", 0)
+
+    # Split with the Rust semantic-text-splitter by default, which tokenizes natively instead of
+    # calling back into Python; the LangChain splitter remains available as a fallback
+    if st.secrets.get("splitter", "rust") == "rust":
+        from semantic_text_splitter import TextSplitter
+        text_splitter = TextSplitter.from_tiktoken_model("text-embedding-ada-002", chunk_size, chunk_overlap)
+
+        def split_documents(docs):
+            return [Document(page_content=chunk, metadata=dict(doc.metadata)) for doc in docs for chunk in text_splitter.chunks(doc.page_content)]
+    else:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            encoding_name = "cl100k_base",
+            chunk_size = chunk_size,
+            chunk_overlap  = chunk_overlap
+        )
+        split_documents = text_splitter.split_documents
+
+    # Load and split a single uploaded file into chunks
+    def load_and_split(i, uploaded_file):
+        print(f"""Processing: {uploaded_file}""")
+        if uploaded_file.name.endswith('txt'):
+            file = [Document(page_content=uploaded_file.read().decode(), metadata={'source': uploaded_file.name})]
+            return split_documents(file)
+
+        if uploaded_file.name.endswith('pdf'):
+            # Stream to temporary file in 1 MiB blocks, prefixed to keep uploads with the same name apart
+            temp_filepath = os.path.join(temp_dir, f"{i}_{uploaded_file.name}")
+            uploaded_file.seek(0)
             with open(temp_filepath, 'wb') as f:
-                f.write(file.getvalue())
+                shutil.copyfileobj(uploaded_file, f, 1 << 20)
 
-            # Create the text splitter
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size = 1500,
-                chunk_overlap  = 100
-            )
+            # Read PDF
+            loader = PyMuPDFLoader(temp_filepath)
+            docs = loader.load()
+            for doc in docs:
+                doc.metadata['source'] = uploaded_file.name
+            return split_documents(docs)
 
-            if uploaded_file.name.endswith('txt'):
-                file = [uploaded_file.read().decode()]
-                texts = text_splitter.create_documents(file, [{'source': uploaded_file.name}])
-                vectorstore.add_documents(texts)
-                st.info(f"{len(texts)} {lang_dict['load_text']}")
+        return []
 
-            if uploaded_file.name.endswith('pdf'):
-                # Read PDF
-                docs = []
-                loader = PyPDFLoader(temp_filepath)
-                docs.extend(loader.load())
+    # Load the files one after another, as PyMuPDF is not thread-safe, and add all chunks to the vectorstore at once
+    uploaded_files = [uploaded_file for uploaded_file in uploaded_files if uploaded_file is not None]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        results = [load_and_split(i, uploaded_file) for i, uploaded_file in enumerate(uploaded_files)]
 
-                pages = text_splitter.split_documents(docs)
-                vectorstore.add_documents(pages)  
-                st.info(f"{len(pages)} {lang_dict['load_pdf']}")
+    all_docs = [doc for docs in results for doc in docs]
+
+    # Embed and insert the chunks across files in large batches, reporting progress per batch
+    progress = st.progress(0)
+    for i in range(0, len(all_docs), upload_batch_size):
+        vectorstore.add_documents(all_docs[i:i + upload_batch_size])
+        progress.progress(min(i + upload_batch_size, len(all_docs)) / len(all_docs))
+    progress.empty()
+
+    if all_docs:
+        # Cached answers don't know about the new context yet
+        semantic_cache.clear()
+
+    for uploaded_file, docs in zip(uploaded_files, results):
+        if uploaded_file.name.endswith('txt'):
+            st.info(f"{len(docs)} {lang_dict['load_text']}")
+        if uploaded_file.name.endswith('pdf'):
+            st.info(f"{len(docs)} {lang_dict['load_pdf']}")
 
 ##################
 ### Data Cache ###
 ##################
 
+# Cache the static CSV bundles, grouped by their first column, so each file is parsed only once
+@st.cache_data()
+def load_bundle(path):
+    print(f"load_bundle {path}")
+    bundle = {}
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader)
+        for group, key, value in reader:
+            bundle.setdefault(group, {})[key] = value
+    return bundle
+
 # Cache localized strings
 @st.cache_data()
 def load_localization(locale):
     print("load_localization")
-    # Load in the text bundle and filter by language locale
-    df = pd.read_csv("localization.csv")
-    df = df.query(f"locale == '{locale}'")
-    # Create and return a dictionary of key/values.
-    lang_dict = {df.key.to_list()[i]:df.value.to_list()[i] for i in range(len(df.key.to_list()))}
-    return lang_dict
+    # Return the text bundle for the language locale
+    return load_bundle("localization.csv")[locale]
 
-# Cache localized strings
+# Cache rails, rendered as a single markdown text
 @st.cache_data()
 def load_rails(username):
     print("load_rails")
-    # Load in the rails bundle and filter by username
-    df = pd.read_csv("rails.csv")
-    df = df.query(f"username == '{username}'")
-    if df.empty:
-        df = pd.read_csv("rails.csv")
-        df = df.query(f"username == 'datastax'")
-    # Create and return a dictionary of key/values.
-    rails_dict = {df.key.to_list()[i]:df.value.to_list()[i] for i in range(len(df.key.to_list()))}
-    return rails_dict
+    # Get the rails bundle for the username, falling back to the datastax rails
+    rails = load_bundle("rails.csv")
+    rails_dict = rails.get(username, rails['datastax'])
+    return "\n".join(f"{key}. {value}" for key, value in rails_dict.items())
+
+# Cache welcome text
+@st.cache_data()
+def load_welcome(username):
+    print("load_welcome")
+    try:
+        return Path(f"""{username}.md""").read_text()
+    except:
+        return Path('welcome.md').read_text()
 
 #############
 ### Login ###
@@ -186,8 +366,8 @@ lang_dict = load_localization(language)
 @st.cache_resource(show_spinner=lang_dict['load_embedding'])
 def load_embedding():
     print("load_embedding")
-    # Get the OpenAI Embedding
-    return OpenAIEmbeddings()
+    # Get the OpenAI Embedding, cached on disk
+    return CachedEmbeddings(OpenAIEmbeddings(), "embeddings.db")
 
 # Cache Vector Store for future runs
 @st.cache_resource(show_spinner=lang_dict['load_vectorstore'])
@@ -203,7 +383,7 @@ def load_vectorstore(username):
     
 # Cache Retriever for future runs
 @st.cache_resource(show_spinner=lang_dict['load_retriever'])
-def load_retriever():
+def load_retriever(username):
     print("load_retriever")
     # Get the Retriever from the Vectorstore
     return vectorstore.as_retriever(
@@ -222,18 +402,18 @@ def load_model():
         verbose=True
     )
 
-# Cache Chat History for future runs
-@st.cache_resource(show_spinner=lang_dict['load_message_history'])
-def load_chat_history(username):
-    print(f"load_chat_history for {username}_{st.session_state.session_id}")
+# Cache Chat History for future runs, bounded as there is an entry per browser session
+@st.cache_resource(show_spinner=lang_dict['load_message_history'], max_entries=session_cache_max_entries, ttl=session_cache_ttl)
+def load_chat_history(username, session_id):
+    print(f"load_chat_history for {username}_{session_id}")
     return AstraDBChatMessageHistory(
-        session_id=f"{username}_{st.session_state.session_id}",
+        session_id=f"{username}_{session_id}",
         api_endpoint=st.secrets.chat_history["ASTRA_VECTOR_ENDPOINT"],
         token=st.secrets.chat_history["ASTRA_VECTOR_TOKEN"],
     )
 
-@st.cache_resource(show_spinner=lang_dict['load_message_history'])
-def load_memory():
+@st.cache_resource(show_spinner=lang_dict['load_message_history'], max_entries=session_cache_max_entries, ttl=session_cache_ttl)
+def load_memory(username, session_id):
     print("load_memory")
     return ConversationBufferWindowMemory(
         chat_memory=chat_history,
@@ -244,15 +424,22 @@ def load_memory():
         output_key='answer',
     )
 
+# Cache Semantic Cache for future runs
+@st.cache_resource(show_spinner=lang_dict['load_semantic_cache'])
+def load_semantic_cache(username):
+    print("load_semantic_cache")
+    return SemanticCache("semantic_cache.db", username, semantic_cache_threshold, semantic_cache_max_entries)
+
 # Cache prompt
 @st.cache_data()
 def load_prompt():
     print("load_prompt")
-    template = """You're a helpful AI assistent tasked to answer the user's questions.
+    # Keep the static instructions in a separate system message, ahead of the per-question context
+    system_template = """You're a helpful AI assistent tasked to answer the user's questions.
 You're friendly and you answer extensively with multiple sentences. You prefer to use bulletpoints to summarize.
-If you don't know the answer, just say 'I do not know the answer'.
+If you don't know the answer, just say 'I do not know the answer'."""
 
-Use the following context to answer the question:
+    template = """Use the following context to answer the question:
 {context}
 
 Use the previous chat history to answer the question:
@@ -263,25 +450,14 @@ Question:
 
 Answer in the user's language:"""
 
-    return ChatPromptTemplate.from_messages([("system", template)])
-
-#####################
-### Session state ###
-#####################
-
-# Start with empty messages, stored in session state
-if 'messages' not in st.session_state:
-    st.session_state.messages = [AIMessage(content=lang_dict['assistant_welcome'])]
+    return ChatPromptTemplate.from_messages([("system", system_template), ("human", template)])
 
 ############
 ### Main ###
 ############
 
 # Write the welcome text
-try:
-    st.markdown(Path(f"""{username}.md""").read_text())
-except:
-    st.markdown(Path('welcome.md').read_text())
+st.markdown(load_welcome(username))
 
 # DataStax logo
 with st.sidebar:
@@ -296,15 +472,21 @@ with st.sidebar:
 
 # Initialize
 with st.sidebar:
-    rails_dict = load_rails(username)
+    rails_text = load_rails(username)
     embedding = load_embedding()
     vectorstore = load_vectorstore(username)
-    retriever = load_retriever()
+    retriever = load_retriever(username)
     model = load_model()
-    chat_history = load_chat_history(username)
-    memory = load_memory()
+    chat_history = load_chat_history(username, st.session_state.session_id)
+    memory = load_memory(username, st.session_state.session_id)
+    semantic_cache = load_semantic_cache(username)
     prompt = load_prompt()
 
+# Start with the welcome message followed by any resumed chat history, stored in session state
+# This way the user sees the same history the model gets from memory
+if 'messages' not in st.session_state:
+    st.session_state.messages = [AIMessage(content=lang_dict['assistant_welcome'])] + chat_history.messages
+
 # Include the upload form for new data to be Vectorized
 with st.sidebar:
     with st.form('upload'):
@@ -331,6 +513,7 @@ if (username in st.secrets['delete_option'] and st.secrets.delete_option[usernam
             if submitted:
                 with st.spinner(lang_dict['deleting_context']):
                     vectorstore.clear()
+                    semantic_cache.clear()
                     memory.clear()
                     st.session_state.messages = [AIMessage(content=lang_dict['assistant_welcome'])]
 
@@ -338,8 +521,7 @@ if (username in st.secrets['delete_option'] and st.secrets.delete_option[usernam
 with st.sidebar:
         st.subheader(lang_dict['rails_1'])
         st.caption(lang_dict['rails_2'])
-        for i in rails_dict:
-            st.markdown(f"{i}. {rails_dict[i]}")
+        st.markdown(rails_text)
 
 # Draw all messages, both user and agent so far (every time the app reruns)
 for message in st.session_state.messages:
@@ -366,48 +548,70 @@ if question := st.chat_input(lang_dict['assistant_question']):
         history = memory.load_memory_variables({})
         print(f"Using memory: {history}")
 
-        inputs = RunnableMap({
-            'context': lambda x: retriever.get_relevant_documents(x['question']),
-            'chat_history': lambda x: x['chat_history'],
-            'question': lambda x: x['question']
-        })
-        print(f"Using inputs: {inputs}")
-
-        chain = (inputs | prompt | model).with_config({"tags": [f"{st.session_state.user}"]})
-        print(f"Using chain: {chain}")
-
-        # Call the chain and stream the results into the UI
-        response = chain.invoke(
-            {'question': question, 'chat_history': history}, 
-            config={'callbacks': [StreamHandler(response_placeholder)]}
-        )
-        print(f"Response: {response}")
-        content = response.content
+        # Reuse the answer of a previous, semantically similar question if there is one
+        # Follow-up questions depend on the chat history, so only standalone questions use the cache
+        use_semantic_cache = not history['chat_history']
+        if use_semantic_cache:
+            question_vector = SemanticCache.normalize(embedding.embed_query(question))
+            cached = semantic_cache.lookup(question_vector)
+        else:
+            cached = None
+        if cached:
+            print(f"Semantic cache hit on: {cached[0]}")
+            # The cached answer is drawn at once with its sources below
+            _, content_final, sources_markdown = cached
+        else:
+            # Retrieve the context once and reuse it for the sources below
+            relevant_documents = retriever.get_relevant_documents(question)
+
+            inputs = RunnableMap({
+                'context': lambda x: relevant_documents,
+                'chat_history': lambda x: x['chat_history'],
+                'question': lambda x: x['question']
+            })
+            print(f"Using inputs: {inputs}")
+
+            chain = (inputs | prompt | model).with_config({"tags": [f"{st.session_state.user}"]})
+            print(f"Using chain: {chain}")
+
+            # Call the chain and stream the results into the UI
+            response = chain.invoke(
+                {'question': question, 'chat_history': history}, 
+                config={'callbacks': [StreamHandler(response_placeholder)]}
+            )
+            print(f"Response: {response}")
+            content_final = response.content
 
-        # Write the sources used
-        relevant_documents = retriever.get_relevant_documents(question)
-        content += f"""
-        
+            # Write the sources used
+            sources_markdown = f"""
+            
 *{lang_dict['sources_used']}:*  
 """
-        sources = []
-        for doc in relevant_documents:
-            source = doc.metadata['source']
-            page_content = doc.page_content
-            if source not in sources:
-                content += f"""📙 :orange[{os.path.basename(os.path.normpath(source))}]  
+            sources = []
+            seen = set()
+            for doc in relevant_documents:
+                source = doc.metadata['source']
+                if source in seen:
+                    continue
+                seen.add(source)
+                sources_markdown += f"""📙 :orange[{Path(source).name}]  
 """
                 sources.append(source)
-        print(f"Used sources: {sources}")
+            print(f"Used sources: {sources}")
+
+            # Add the answer to the semantic cache
+            if use_semantic_cache:
+                semantic_cache.add(question, content_final, sources_markdown, question_vector)
 
-        # Write the final answer without the cursor
-        response_placeholder.markdown(content)
+        # Write the final answer with its sources, without the cursor
+        content_with_sources = content_final + sources_markdown
+        response_placeholder.markdown(content_with_sources)
 
-        # Add the result to memory
-        memory.save_context({'question': question}, {'answer': content})
+        # Add only the answer itself to memory, to keep the chat history in later prompts small
+        memory.save_context({'question': question}, {'answer': content_final})
 
         # Add the answer to the messages session state
-        st.session_state.messages.append(AIMessage(content=content))
+        st.session_state.messages.append(AIMessage(content=content_with_sources))
 
 with st.sidebar:
             st.caption("v231207.01")
\ No newline at end of file